@@ -11,9 +11,31 @@ import pandas as pd
 import numpy as np
 from dotenv import load_dotenv
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from typing import Dict, List, Any
 import json
+import logging
+import math
 import re
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import orjson  # Optional: faster JSON parsing for API responses and checkpoints
+except ImportError:
+    orjson = None
+
+try:
+    import httpx  # Optional: HTTP/2 transport, see USE_HTTP2
+except ImportError:
+    httpx = None
+
+try:
+    from requests_cache import CachedSession  # Optional: on-disk API response cache
+except ImportError:
+    CachedSession = None
 
 # ==================== CONFIGURATION ====================
 # Sampling strategy for pattern analysis
@@ -32,6 +54,17 @@ QUOTA_RESERVE = 200  # Keep some quota in reserve
 SEARCH_COST = 100  # Each search costs 100 units
 VIDEO_DETAILS_COST = 1  # Each video details call costs 1 unit
 MAX_RESULTS_PER_SEARCH = 50
+SEARCH_CONCURRENCY = 4  # Keyword searches run in parallel per round
+MAX_ATTEMPTS_PER_TIER = 30
+DETAILS_CONCURRENCY = 10  # Parallel video details batches
+MAX_REQUESTS_PER_SECOND = 5  # Shared across all worker threads
+HTTP_POOL_SIZE = 20  # Keep-alive connections kept open to googleapis.com
+CACHE_EXPIRE_SECONDS = 12 * 3600  # Cached responses cost no quota
+USE_HTTP2 = False  # Multiplex over httpx HTTP/2; skips the response cache
+QUOTA_LOG_EVERY = 100  # Log quota usage at INFO level every N charged calls
+THROTTLE_RETRIES = 3  # Retries after a rate-limit 403/429
+THROTTLE_BACKOFF_SECONDS = 30  # Doubled on each retry
+RATE_LIMIT_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'}
 
 # Search parameters
 SPACE_KEYWORDS = [
@@ -65,9 +98,15 @@ TIME_WINDOWS = [
 
 # Output configuration
 OUTPUT_DIR = "space_video_patterns"
-CHECKPOINT_FILE = "scraping_progress.json"
+CHECKPOINT_FILE = "scraping_progress.json"  # Legacy checkpoint, migrated on first run
+VIDEOS_FILE = "videos.jsonl"  # One accepted video per line
+KEYWORD_STATS_FILE = "keyword_stats.json"  # Per-tier keyword hit rates
+CACHE_FILE = "yt_cache.sqlite"  # Used when requests-cache is installed
+CSV_CHUNK_SIZE = 1000  # Rows loaded per chunk when writing the final CSV
+STATS_COLUMNS = ['view_count', 'title_word_count', 'has_question', 'has_emoji']
 
 # ==================== SETUP ====================
+log = logging.getLogger(__name__)
 load_dotenv()
 API_KEY = os.getenv("YOUTUBE_API_KEY")
 if not API_KEY:
@@ -76,40 +115,165 @@ if not API_KEY:
 # Create output directory
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
+# Shared keep-alive session; transient server errors are retried with backoff
+if CachedSession is not None:
+    # The API key is left out of the cache key so rotated keys still hit
+    SESSION = CachedSession(
+        os.path.join(OUTPUT_DIR, CACHE_FILE),
+        backend='sqlite',
+        expire_after=CACHE_EXPIRE_SECONDS,
+        allowable_methods=['GET'],
+        cache_control=False,
+        ignored_parameters=['key'],
+    )
+else:
+    SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=HTTP_POOL_SIZE,
+    pool_maxsize=HTTP_POOL_SIZE,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504]),
+))
+
+# Client used for API calls: the requests session, or one multiplexed HTTP/2 connection
+if USE_HTTP2:
+    if httpx is None:
+        raise ValueError("USE_HTTP2 requires httpx: pip install 'httpx[http2]'")
+    HTTP_CLIENT = httpx.Client(transport=httpx.HTTPTransport(
+        http2=True,
+        retries=3,  # Connection failures only; throttling is handled in safe_api_call
+        limits=httpx.Limits(max_connections=HTTP_POOL_SIZE),
+    ))
+else:
+    HTTP_CLIENT = SESSION
+
 # ==================== HELPER FUNCTIONS ====================
+_DURATION_RE = re.compile(r'PT(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?')
+_EMOJI_RE = re.compile(r'[\U0001F300-\U0001F9FF]')
+# Deletes every non-uppercase ASCII char, so translate() keeps only capitals
+_NON_UPPER_ASCII = dict.fromkeys(i for i in range(128) if not chr(i).isupper())
+
+def dumps_line(obj) -> bytes:
+    """Serialize obj as one newline-terminated JSON record"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(obj) + '\n').encode('utf-8')
+
+def loads(data):
+    """Parse JSON from str or bytes"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
 class QuotaManager:
     def __init__(self, daily_limit=QUOTA_DAILY_LIMIT, reserve=QUOTA_RESERVE):
         self.daily_limit = daily_limit
         self.reserve = reserve
         self.used = 0
+        self.calls = 0
+        self._lock = threading.Lock()  # Searches run on worker threads
         self.checkpoint_file = os.path.join(OUTPUT_DIR, "quota_status.json")
         self.load_checkpoint()
     
     def load_checkpoint(self):
         if os.path.exists(self.checkpoint_file):
-            with open(self.checkpoint_file, 'r') as f:
-                data = json.load(f)
+            with open(self.checkpoint_file, 'rb') as f:
+                data = loads(f.read())
                 if data['date'] == datetime.now().strftime('%Y-%m-%d'):
                     self.used = data['used']
     
     def save_checkpoint(self):
-        with open(self.checkpoint_file, 'w') as f:
-            json.dump({
+        with open(self.checkpoint_file, 'wb') as f:
+            f.write(dumps_line({
                 'date': datetime.now().strftime('%Y-%m-%d'),
                 'used': self.used
-            }, f)
+            }))
     
     def can_use(self, units):
-        remaining = self.daily_limit - self.used
-        print(f"Quota status: {self.used}/{self.daily_limit} used ({remaining} remaining)")
+        log.debug("Quota status: %d/%d used", self.used, self.daily_limit)
         return self.used + units < (self.daily_limit - self.reserve)
     
     def use(self, units):
-        if not self.can_use(units):
-            raise Exception(f"Quota limit reached. Used: {self.used}, Requested: {units}")
-        self.used += units
-        self.save_checkpoint()
-        print(f"Quota used: {self.used}/{self.daily_limit} ({self.used/self.daily_limit*100:.1f}%)")
+        with self._lock:
+            if not self.can_use(units):
+                raise Exception(f"Quota limit reached. Used: {self.used}, Requested: {units}")
+            self.used += units
+            self.calls += 1
+            self.save_checkpoint()
+            if self.calls % QUOTA_LOG_EVERY == 0:
+                log.info("Quota used: %d/%d (%.1f%%)", self.used, self.daily_limit, self.used / self.daily_limit * 100)
+    
+    def refund(self, units):
+        """Return units reserved by use() for a call that was not billed"""
+        with self._lock:
+            self.used -= units
+            self.save_checkpoint()
+
+class RateLimiter:
+    """Sliding-window limiter shared by all API calls"""
+    def __init__(self, max_calls, period=1.0):
+        self.max_calls = max_calls
+        self.period = period
+        self._calls = deque()
+        self._lock = threading.Lock()
+    
+    def wait(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._calls and now - self._calls[0] >= self.period:
+                    self._calls.popleft()
+                if len(self._calls) < self.max_calls:
+                    self._calls.append(now)
+                    return
+                delay = self.period - (now - self._calls[0])
+            time.sleep(delay)
+
+class AdaptiveConcurrency:
+    """AIMD cap on in-flight API calls: halved when throttled, grown by one after a run of successes"""
+    def __init__(self, max_limit, success_window=20):
+        self.max_limit = max_limit
+        self.limit = max_limit
+        self.success_window = success_window
+        self._active = 0
+        self._successes = 0
+        self._cond = threading.Condition()
+    
+    def __enter__(self):
+        with self._cond:
+            while self._active >= self.limit:
+                self._cond.wait()
+            self._active += 1
+        return self
+    
+    def __exit__(self, *exc_info):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+    
+    def on_success(self):
+        with self._cond:
+            self._successes += 1
+            if self._successes >= self.success_window and self.limit < self.max_limit:
+                self.limit += 1
+                self._successes = 0
+                self._cond.notify_all()
+    
+    def on_throttle(self):
+        with self._cond:
+            self.limit = max(1, self.limit // 2)
+            self._successes = 0
+        log.warning("API throttled, concurrency limit now %d", self.limit)
+
+rate_limiter = RateLimiter(MAX_REQUESTS_PER_SECOND)
+# Peak in-flight calls: the search workers plus the single details batch being processed
+concurrency = AdaptiveConcurrency(SEARCH_CONCURRENCY + 1)
+
+def get_error_reason(response):
+    """Extract the YouTube error reason (e.g. 'quotaExceeded') from an error response"""
+    try:
+        return loads(response.content)['error']['errors'][0]['reason']
+    except (ValueError, KeyError, IndexError, TypeError):
+        return None
 
 def safe_api_call(url: str, params: Dict[str, Any], quota_cost: int) -> Dict:
     """Make API call with safety checks and quota management"""
@@ -117,30 +281,53 @@ def safe_api_call(url: str, params: Dict[str, Any], quota_cost: int) -> Dict:
     safe_params = {k: v for k, v in params.items() if k != 'key'}
     safe_params['key'] = 'REDACTED'
     
-    # Check quota
-    if not quota_manager.can_use(quota_cost):
-        raise Exception("Daily quota would be exceeded")
+    # Reserve quota before sending so concurrent calls cannot overshoot the limit
+    quota_manager.use(quota_cost)
     
-    # Make request with retries
-    for attempt in range(3):
-        try:
-            response = requests.get(url, params=params, timeout=10)
+    try:
+        # Server errors are retried by the session's HTTPAdapter; throttling backs off here
+        for attempt in range(THROTTLE_RETRIES + 1):
+            rate_limiter.wait()
+            with concurrency:
+                response = HTTP_CLIENT.get(url, params=params, timeout=10)
+            
+            if response.status_code in (403, 429):
+                reason = get_error_reason(response)
+                if reason == 'quotaExceeded':
+                    raise Exception("Daily quota exceeded (API returned quotaExceeded)")
+                if (response.status_code == 429 or reason in RATE_LIMIT_REASONS) and attempt < THROTTLE_RETRIES:
+                    concurrency.on_throttle()
+                    time.sleep(THROTTLE_BACKOFF_SECONDS * 2 ** attempt)
+                    continue
+            
             response.raise_for_status()
-            quota_manager.use(quota_cost)
-            time.sleep(0.5)  # Rate limiting
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            print(f"API call failed (attempt {attempt + 1}/3): {e}")
-            if attempt < 2:
-                time.sleep(2 ** attempt)
-            else:
-                raise
+            concurrency.on_success()
+            data = loads(response.content)
+            break
+    except Exception:
+        quota_manager.refund(quota_cost)
+        raise
+    
+    if getattr(response, 'from_cache', False):
+        quota_manager.refund(quota_cost)  # Served from disk, not billed
+    return data
 
 def parse_duration(duration_str):
     """Parse ISO 8601 duration to seconds"""
     if not duration_str:
         return None
-    match = re.match(r'PT(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?', duration_str)
+    # Fast path for the common Shorts forms (PTxS, PTxMyS) without hours
+    if duration_str.startswith('PT') and 'H' not in duration_str:
+        body = duration_str[2:]
+        m_idx = body.find('M')
+        minutes = body[:m_idx] if m_idx >= 0 else '0'
+        rest = body[m_idx + 1:]
+        s_idx = rest.find('S')
+        seconds = rest[:s_idx] if s_idx >= 0 else '0'
+        if minutes.isdecimal() and seconds.isdecimal():
+            return int(minutes) * 60 + int(seconds)
+        # Unusual format; let the regex handle it
+    match = _DURATION_RE.match(duration_str)
     if not match:
         return None
     hours = int(match.group(1) or 0)
@@ -148,12 +335,36 @@ def parse_duration(duration_str):
     seconds = int(match.group(3) or 0)
     return hours * 3600 + minutes * 60 + seconds
 
+def count_uppercase(text):
+    """Count uppercase characters without a per-character Python loop"""
+    if text.isascii():
+        return len(text.translate(_NON_UPPER_ASCII))
+    return sum(map(str.isupper, text))
+
 def get_time_window_dates(days_back):
     """Get date range for search"""
-    end_date = datetime.now(timezone.utc)
+    # Day-aligned so repeated searches share a cache entry
+    end_date = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
     start_date = end_date - timedelta(days=days_back)
     return start_date.isoformat(), end_date.isoformat()
 
+def get_search_strategy(tier_name, attempt):
+    """Pick search order and time window for a tier"""
+    if tier_name in ['very_low', 'low']:
+        # For low-view videos, prioritize recent uploads
+        return 'date', TIME_WINDOWS[2]  # Use 30-day window
+    if tier_name in ['mega_viral']:
+        # For viral videos, use viewCount
+        return 'viewCount', TIME_WINDOWS[0]  # Use full year
+    # For middle tiers, rotate strategies
+    strategies = [
+        ('relevance', TIME_WINDOWS[0]),
+        ('viewCount', TIME_WINDOWS[1]),
+        ('rating', TIME_WINDOWS[0]),
+        ('date', TIME_WINDOWS[2])
+    ]
+    return strategies[attempt % len(strategies)]
+
 def search_videos(keyword, published_after, published_before, order='relevance'):
     """Search for videos with specific criteria"""
     url = "https://www.googleapis.com/youtube/v3/search"
@@ -169,6 +380,7 @@ def search_videos(keyword, published_after, published_before, order='relevance')
         'order': order,
         # 'regionCode': 'US',  # Commented out for global search
         'relevanceLanguage': 'en',  # Keep English
+        'fields': 'items(id(videoId)),pageInfo(totalResults)',
         'key': API_KEY
     }
     
@@ -191,29 +403,42 @@ def search_videos(keyword, published_after, published_before, order='relevance')
     
     return results
 
+def _fetch_batch(batch):
+    """Get details for a single batch of up to 50 videos"""
+    url = "https://www.googleapis.com/youtube/v3/videos"
+    params = {
+        'part': 'snippet,statistics,contentDetails',
+        'id': ','.join(batch),
+        # Only the fields process_video_details reads
+        'fields': 'items(id,snippet(title,description,channelTitle,publishedAt,tags),'
+                  'statistics(viewCount,likeCount,commentCount),contentDetails(duration))',
+        'key': API_KEY
+    }
+    
+    response = safe_api_call(url, params, VIDEO_DETAILS_COST)
+    if not response:
+        return []
+    return response.get('items', [])
+
 def get_video_details(video_ids):
     """Get detailed information for videos"""
-    url = "https://www.googleapis.com/youtube/v3/videos"
+    # Process in batches of 50, fetched in parallel
+    batches = [video_ids[i:i+50] for i in range(0, len(video_ids), 50)]
+    if len(batches) <= 1:
+        # The usual case (callers pass at most 20 IDs); no pool needed
+        return _fetch_batch(batches[0]) if batches else []
     
-    # Process in batches of 50
     all_details = []
-    for i in range(0, len(video_ids), 50):
-        batch = video_ids[i:i+50]
-        params = {
-            'part': 'snippet,statistics,contentDetails',
-            'id': ','.join(batch),
-            'key': API_KEY
-        }
-        
-        response = safe_api_call(url, params, VIDEO_DETAILS_COST)
-        if response:
-            all_details.extend(response.get('items', []))
+    with ThreadPoolExecutor(max_workers=DETAILS_CONCURRENCY) as executor:
+        for items in executor.map(_fetch_batch, batches):
+            all_details.extend(items)
     
     return all_details
 
 def process_video_details(video_data):
     """Extract relevant features from video data"""
     processed = []
+    now_utc = datetime.now(timezone.utc)  # One clock read for the whole batch
     
     for video in video_data:
         snippet = video.get('snippet', {})
@@ -225,150 +450,277 @@ def process_video_details(video_data):
         if not duration_sec or duration_sec > 60:
             continue  # Skip non-shorts
         
+        # Pull each field once; features below reuse these locals
+        title = snippet.get('title', '')
+        tags = snippet.get('tags', [])
+        views = int(stats.get('viewCount', 0))
+        title_length = len(title)
+        
         # Calculate views per hour
         published_at = snippet.get('publishedAt')
         try:
             pub_date = datetime.fromisoformat(published_at.replace('Z', '+00:00'))
-            age_hours = (datetime.now(timezone.utc) - pub_date).total_seconds() / 3600
-            views = int(stats.get('viewCount', 0))
+            age_hours = (now_utc - pub_date).total_seconds() / 3600
             vph = views / max(age_hours, 1)
         except:
             vph = 0
         
         processed.append({
             'video_id': video['id'],
-            'title': snippet.get('title', ''),
+            'title': title,
             'description': snippet.get('description', ''),
             'channel_title': snippet.get('channelTitle', ''),
             'published_at': published_at,
             'duration_seconds': duration_sec,
-            'view_count': int(stats.get('viewCount', 0)),
+            'view_count': views,
             'like_count': int(stats.get('likeCount', 0)),
             'comment_count': int(stats.get('commentCount', 0)),
             'views_per_hour': vph,
-            'title_length': len(snippet.get('title', '')),
-            'title_word_count': len(snippet.get('title', '').split()),
-            'has_emoji': bool(re.search(r'[\U0001F300-\U0001F9FF]', snippet.get('title', ''))),
-            'has_question': '?' in snippet.get('title', ''),
-            'has_exclamation': '!' in snippet.get('title', ''),
-            'caps_ratio': sum(1 for c in snippet.get('title', '') if c.isupper()) / max(len(snippet.get('title', '')), 1),
-            'tags': '|'.join(snippet.get('tags', [])),
-            'tag_count': len(snippet.get('tags', []))
+            'title_length': title_length,
+            'title_word_count': len(title.split()),
+            'has_emoji': bool(_EMOJI_RE.search(title)),
+            'has_question': '?' in title,
+            'has_exclamation': '!' in title,
+            'caps_ratio': count_uppercase(title) / max(title_length, 1),
+            'tags': '|'.join(tags),
+            'tag_count': len(tags)
         })
     
     return processed
 
+# ==================== CHECKPOINT FUNCTIONS ====================
+def iter_jsonl(path):
+    """Stream records from a JSON Lines file"""
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                yield loads(line)
+            except json.JSONDecodeError:
+                continue  # Partial line left by an interrupted run
+
+def truncate_partial_line(path, block_size=65536):
+    """Drop an unterminated last line so new records start on a fresh line"""
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb+') as f:
+        end = f.seek(0, os.SEEK_END)
+        pos = end
+        while pos > 0:
+            start = max(0, pos - block_size)
+            f.seek(start)
+            block = f.read(pos - start)
+            newline = block.rfind(b'\n')
+            if newline >= 0:
+                pos = start + newline + 1
+                break
+            pos = start
+        if pos < end:
+            f.truncate(pos)
+            print(f"Dropped partial last line from {path}")
+
+def migrate_legacy_checkpoint(legacy_path, videos_path):
+    """Convert a scraping_progress.json checkpoint to the JSONL file"""
+    if os.path.exists(videos_path) or not os.path.exists(legacy_path):
+        return
+    with open(legacy_path, 'rb') as f:
+        checkpoint = loads(f.read())
+    
+    with open(videos_path, 'wb') as f:
+        for tier_name, videos in checkpoint.get('collected', {}).items():
+            for video in videos:
+                f.write(dumps_line({**video, 'tier': tier_name}))
+    print(f"Migrated checkpoint {legacy_path} to {videos_path}")
+
+def load_checkpoint(videos_path):
+    """Rebuild per-tier counts and seen IDs from the JSONL checkpoint"""
+    tier_counts = {tier_name: 0 for tier_name in VIRALITY_TIERS}
+    seen_ids = set()
+    
+    for video in iter_jsonl(videos_path):
+        tier_counts[video['tier']] = tier_counts.get(video['tier'], 0) + 1
+        seen_ids.add(video['video_id'])
+    
+    return tier_counts, seen_ids
+
+def load_keyword_stats(path):
+    """Load per-tier {keyword: [hits, tries]} search yields"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'rb') as f:
+        return loads(f.read())
+
+def save_keyword_stats(path, keyword_stats):
+    with open(path, 'wb') as f:
+        f.write(dumps_line(keyword_stats))
+
+def sample_keywords(kw_stats, count):
+    """Pick distinct keywords, weighted by their smoothed hit rate for a tier"""
+    candidates = list(dict.fromkeys(SPACE_KEYWORDS))
+    weights = []
+    for keyword in candidates:
+        hits, tries = kw_stats.get(keyword, (0, 0))
+        weights.append((hits + 1) / (tries + 2))
+    
+    picked = []
+    for _ in range(min(count, len(candidates))):
+        i = random.choices(range(len(candidates)), weights=weights)[0]
+        picked.append(candidates.pop(i))
+        weights.pop(i)
+    return picked
+
+def record_keyword_result(kw_stats, keyword, hits):
+    prev_hits, prev_tries = kw_stats.get(keyword, (0, 0))
+    kw_stats[keyword] = [prev_hits + hits, prev_tries + 1]
+
+def write_dataset(videos_path, output_path):
+    """Stream the JSONL checkpoint to CSV in chunks, returning only the columns used for statistics"""
+    metrics = []
+    columns = None
+    records = []
+    
+    def flush_chunk():
+        nonlocal columns
+        first = columns is None
+        chunk = pd.DataFrame(records, columns=columns)
+        columns = list(chunk.columns)  # Keep every chunk in the first chunk's column order
+        chunk.to_csv(output_path, index=False, mode='w' if first else 'a', header=first)
+        metrics.append(chunk[STATS_COLUMNS])
+        records.clear()
+    
+    # iter_jsonl skips damaged lines the same way load_checkpoint does
+    for video in iter_jsonl(videos_path):
+        records.append(video)
+        if len(records) >= CSV_CHUNK_SIZE:
+            flush_chunk()
+    if records:
+        flush_chunk()
+    return pd.concat(metrics, ignore_index=True)
+
 # ==================== MAIN SCRAPING LOGIC ====================
+def collect_tier(tier_name, tier_config, collected, seen_ids, keyword_stats, stats_path, videos_file):
+    """Search until a tier reaches its target, appending accepted videos to the checkpoint"""
+    kw_stats = keyword_stats.setdefault(tier_name, {})
+    target_count = tier_config['target_count']
+    min_views = tier_config.get('min_views', 0)
+    max_views = tier_config.get('max_views', float('inf'))
+    
+    attempts = 0
+    searches_done = 0
+    accepted_this_run = 0
+    quota_exhausted = False
+    with ThreadPoolExecutor(max_workers=SEARCH_CONCURRENCY) as executor:
+        while collected < target_count and attempts < MAX_ATTEMPTS_PER_TIER:
+            # Plan a round of searches and run them concurrently
+            searches = []
+            round_size = min(SEARCH_CONCURRENCY, MAX_ATTEMPTS_PER_TIER - attempts)
+            if accepted_this_run:
+                # Don't launch more 100-unit searches than the observed yield needs
+                expected_yield = accepted_this_run / searches_done
+                round_size = min(round_size, math.ceil((target_count - collected) / expected_yield))
+            # Sample keywords, favouring ones that have yielded videos for this tier
+            for keyword in sample_keywords(kw_stats, round_size):
+                attempts += 1
+                
+                order, time_window = get_search_strategy(tier_name, attempts)
+                start_date, end_date = get_time_window_dates(time_window['days_back'])
+                
+                print(f"\nAttempt {attempts}: Searching '{keyword}' in last {time_window['days_back']} days (order: {order})")
+                future = executor.submit(search_videos, keyword, start_date, end_date, order)
+                searches.append((keyword, order, future))
+            
+            # Process results in submission order so tier counts stay exact.
+            # Searches finishing after the tier fills are already billed, so they
+            # still feed the keyword stats.
+            for keyword, order, future in searches:
+                try:
+                    video_ids = future.result()
+                    searches_done += 1
+                    # Drop repeats within the batch too, keeping search rank order
+                    new_ids = [vid for vid in dict.fromkeys(video_ids) if vid not in seen_ids]
+                    
+                    if not new_ids:
+                        record_keyword_result(kw_stats, keyword, 0)
+                        continue
+                    
+                    # Get details
+                    video_details = get_video_details(new_ids[:20])  # Limit batch size
+                    processed = process_video_details(video_details)
+                    if order == 'viewCount':
+                        # Most viewed first, so the scan can stop at the first video below the tier
+                        processed.sort(key=lambda video: video['view_count'], reverse=True)
+                    
+                    # Filter by tier requirements; accepted videos are appended to the checkpoint
+                    matched = 0
+                    for video in processed:
+                        if order == 'viewCount' and video['view_count'] < min_views:
+                            break
+                        if min_views <= video['view_count'] < max_views:
+                            matched += 1
+                            if collected < target_count:
+                                video['tier'] = tier_name  # Records are fresh per batch; tag in place
+                                videos_file.write(dumps_line(video))
+                                seen_ids.add(video['video_id'])
+                                collected += 1
+                                accepted_this_run += 1
+                    
+                    record_keyword_result(kw_stats, keyword, matched)
+                    print(f"Collected {collected}/{target_count} for {tier_name}")
+                    
+                    # Save checkpoint
+                    videos_file.flush()
+                    save_keyword_stats(stats_path, keyword_stats)
+                    
+                except Exception as e:
+                    print(f"Error: {e}")
+                    if "quota" in str(e).lower():
+                        quota_exhausted = True
+            
+            if quota_exhausted:
+                print("Quota limit reached. Run again tomorrow to continue.")
+                break
+    
+    return collected
+
 def scrape_stratified_sample():
     """Scrape videos across different virality tiers"""
-    quota_manager = QuotaManager()
-    all_videos = []
-    
     # Load checkpoint if exists
-    checkpoint_path = os.path.join(OUTPUT_DIR, CHECKPOINT_FILE)
-    if os.path.exists(checkpoint_path):
-        with open(checkpoint_path, 'r') as f:
-            checkpoint = json.load(f)
-    else:
-        checkpoint = {'collected': {}, 'seen_ids': []}
-    
-    seen_ids = set(checkpoint['seen_ids'])
+    videos_path = os.path.join(OUTPUT_DIR, VIDEOS_FILE)
+    migrate_legacy_checkpoint(os.path.join(OUTPUT_DIR, CHECKPOINT_FILE), videos_path)
+    truncate_partial_line(videos_path)
+    tier_counts, seen_ids = load_checkpoint(videos_path)
+    stats_path = os.path.join(OUTPUT_DIR, KEYWORD_STATS_FILE)
+    keyword_stats = load_keyword_stats(stats_path)
     
     print("=== Starting Stratified Sampling ===")
     print(f"Target distribution: {sum(tier['target_count'] for tier in VIRALITY_TIERS.values())} total videos")
     
     # Collect videos for each tier
-    for tier_name, tier_config in VIRALITY_TIERS.items():
-        print(f"\n--- Collecting {tier_name} tier ---")
-        tier_videos = checkpoint['collected'].get(tier_name, [])
-        
-        if len(tier_videos) >= tier_config['target_count']:
-            print(f"Already collected {len(tier_videos)}/{tier_config['target_count']} videos")
-            all_videos.extend(tier_videos)
-            continue
-        
-        attempts = 0
-        while len(tier_videos) < tier_config['target_count'] and attempts < 30:
-            attempts += 1
+    with open(videos_path, 'ab') as videos_file:
+        for tier_name, tier_config in VIRALITY_TIERS.items():
+            print(f"\n--- Collecting {tier_name} tier ---")
             
-            # Sample keyword
-            keyword = random.choice(SPACE_KEYWORDS)
+            if tier_counts[tier_name] >= tier_config['target_count']:
+                print(f"Already collected {tier_counts[tier_name]}/{tier_config['target_count']} videos")
+                continue
             
-            # Rotate through different search strategies based on tier
-            if tier_name in ['very_low', 'low']:
-                # For low-view videos, prioritize recent uploads
-                order = 'date'
-                time_window = TIME_WINDOWS[2]  # Use 30-day window
-            elif tier_name in ['mega_viral']:
-                # For viral videos, use viewCount
-                order = 'viewCount'
-                time_window = TIME_WINDOWS[0]  # Use full year
-            else:
-                # For middle tiers, rotate strategies
-                strategies = [
-                    ('relevance', TIME_WINDOWS[0]),
-                    ('viewCount', TIME_WINDOWS[1]),
-                    ('rating', TIME_WINDOWS[0]),
-                    ('date', TIME_WINDOWS[2])
-                ]
-                order, time_window = strategies[attempts % len(strategies)]
-            
-            start_date, end_date = get_time_window_dates(time_window['days_back'])
-            
-            print(f"\nAttempt {attempts}: Searching '{keyword}' in last {time_window['days_back']} days (order: {order})")
-            
-            try:
-                # Search for videos
-                video_ids = search_videos(keyword, start_date, end_date, order)
-                new_ids = [vid for vid in video_ids if vid not in seen_ids]
-                
-                if not new_ids:
-                    continue
-                
-                # Get details
-                video_details = get_video_details(new_ids[:20])  # Limit batch size
-                processed = process_video_details(video_details)
-                
-                # Filter by tier requirements
-                for video in processed:
-                    views = video['view_count']
-                    min_views = tier_config.get('min_views', 0)
-                    max_views = tier_config.get('max_views', float('inf'))
-                    
-                    if min_views <= views < max_views:
-                        tier_videos.append(video)
-                        seen_ids.add(video['video_id'])
-                        
-                        if len(tier_videos) >= tier_config['target_count']:
-                            break
-                
-                print(f"Collected {len(tier_videos)}/{tier_config['target_count']} for {tier_name}")
-                
-                # Save checkpoint
-                checkpoint['collected'][tier_name] = tier_videos
-                checkpoint['seen_ids'] = list(seen_ids)
-                with open(checkpoint_path, 'w') as f:
-                    json.dump(checkpoint, f)
-                
-            except Exception as e:
-                print(f"Error: {e}")
-                if "quota" in str(e).lower():
-                    print("Quota limit reached. Run again tomorrow to continue.")
-                    break
-        
-        all_videos.extend(tier_videos)
+            tier_counts[tier_name] = collect_tier(
+                tier_name, tier_config, tier_counts[tier_name], seen_ids,
+                keyword_stats, stats_path, videos_file
+            )
     
     # Save final dataset
-    if all_videos:
-        df = pd.DataFrame(all_videos)
+    if sum(tier_counts.values()):
         output_path = os.path.join(OUTPUT_DIR, f"space_videos_patterns_{datetime.now().strftime('%Y%m%d')}.csv")
-        df.to_csv(output_path, index=False)
+        df = write_dataset(videos_path, output_path)
         print(f"\n=== Scraping Complete ===")
         print(f"Total videos collected: {len(df)}")
         print(f"Distribution by tier:")
         for tier_name in VIRALITY_TIERS:
-            count = len([v for v in all_videos if v in checkpoint['collected'].get(tier_name, [])])
-            print(f"  {tier_name}: {count}")
+            print(f"  {tier_name}: {tier_counts[tier_name]}")
         print(f"Output saved to: {output_path}")
         
         # Quick statistics
@@ -379,6 +731,8 @@ def scrape_stratified_sample():
         print(f"Videos with emojis: {df['has_emoji'].sum()} ({df['has_emoji'].mean()*100:.1f}%)")
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    
     # Initialize quota manager globally
     quota_manager = QuotaManager()
     